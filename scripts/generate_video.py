@@ -4,6 +4,7 @@
 # dependencies = [
 #   "google-genai>=1.0.0",
 #   "pillow",
+#   "urllib3>=2",
 # ]
 # ///
 """
@@ -20,17 +21,23 @@ Gemini API notes:
   - Duration must be even: 4, 6, or 8 seconds
   - Resolution: 720p or 1080p
   - last_frame, seed, fps, generate_audio not supported (Vertex AI only)
-  - enhance_prompt not supported on veo-3.x models
+  - enhance_prompt (opt-in via --enhance-prompt) not supported on veo-3.x models
 """
 
 import argparse
+import asyncio
+import contextlib
+import functools
 import os
+import random
+import shutil
 import sys
 import time
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import MappingProxyType
 
-MODEL_ALIASES = {
+MODEL_ALIASES = MappingProxyType({
     "fast":    "veo-3.1-fast-generate-preview",
     "quality": "veo-3.1-generate-preview",
     "3.1":     "veo-3.1-generate-preview",
@@ -39,29 +46,324 @@ MODEL_ALIASES = {
     "3.0fast": "veo-3.0-fast-generate-001",
     "2.0":     "veo-2.0-generate-001",
     "2":       "veo-2.0-generate-001",
-}
+})
 
-VALID_DURATIONS = {4, 6, 8}
+VALID_DURATIONS = frozenset({4, 6, 8})
+MIN_DURATION = min(VALID_DURATIONS)
+MAX_DURATION = max(VALID_DURATIONS)
+
+# Largest input/reference image accepted before upload
+MAX_IMAGE_BYTES = 20 << 20
+
+# Max threads used to read input/reference images concurrently
+MAX_LOAD_WORKERS = 8
+
+# Max concurrent video saves across all batches; also the HTTP pool size
+MAX_SAVE_WORKERS = 4
+
+# Read size when streaming video downloads to disk
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+# Max bytes handed to a single os.write when saving inline video bytes
+WRITE_CHUNK_SIZE = 4 << 20
+
+# Whole-download attempts, backing off 1s → 2s between them
+DOWNLOAD_ATTEMPTS = 3
+DOWNLOAD_RETRY_DELAY = 1
+
+# Download socket timeouts (seconds); the read timeout applies per recv, not per file
+DOWNLOAD_CONNECT_TIMEOUT = 10
+DOWNLOAD_READ_TIMEOUT = 60
+
+# Operation polling backoff (seconds): 0.5 → 0.75 → 1.1 → ... capped at 15,
+# plus up to POLL_JITTER of random jitter per sleep
+POLL_INITIAL_DELAY = 0.5
+POLL_BACKOFF = 1.5
+POLL_MAX_DELAY = 15
+POLL_JITTER = 0.25
+# Seconds between updates of the in-place "Waiting… Ns" line
+PROGRESS_INTERVAL = 5
+# Pad status lines to this width so they fully overwrite the progress line
+PROGRESS_WIDTH = 20
+
+# Per-request HTTP timeouts (seconds). Submits upload reference images, so get more room.
+POLL_TIMEOUT = 30
+SUBMIT_TIMEOUT = 120
+# Give up after this many consecutive failed polls
+POLL_MAX_FAILURES = 5
+
+# google.genai.types, bound by amain() once the API key has been checked
+_genai_types = None
 
 
 def resolve_model(name: str) -> str:
-    return MODEL_ALIASES.get(name.lower(), name)
+    return MODEL_ALIASES.get(name if name.islower() else name.lower(), name)
 
 
 def nearest_valid_duration(d: int) -> int:
-    return min(VALID_DURATIONS, key=lambda x: abs(x - d))
+    # VALID_DURATIONS is every even value in [MIN_DURATION, MAX_DURATION]: round odd up, then clamp
+    return max(MIN_DURATION, min(MAX_DURATION, d + (d & 1)))
+
+
+def sniff_mime(header: bytes) -> str | None:
+    """Detect image MIME type from the first 12 bytes of a file."""
+    if header[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if header[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def check_image(path: str) -> str | None:
+    """Cheap pre-flight check; returns an error message, or None if usable."""
+    try:
+        size = os.stat(path).st_size
+        with open(path, "rb") as f:
+            header = f.read(12)
+    except OSError as e:
+        return f"cannot read {path}: {e.strerror}"
+    if size == 0:
+        return f"{path} is empty"
+    if size > MAX_IMAGE_BYTES:
+        return f"{path} is {size / (1 << 20):.1f} MiB (max {MAX_IMAGE_BYTES >> 20} MiB)"
+    # Content must identify itself; a valid suffix alone does not make an image
+    if sniff_mime(header) is None:
+        return f"{path} is not a JPEG, PNG or WebP image"
+    return None
+
+
+def build_config_kwargs(args, model: str, duration: int) -> dict:
+    """GenerateVideosConfig kwargs for the options the Gemini API accepts."""
+    config_kwargs = {
+        "number_of_videos": args.count,
+        "duration_seconds": duration,
+        "aspect_ratio": args.aspect_ratio,
+        "http_options": _genai_types.HttpOptions(timeout=SUBMIT_TIMEOUT * 1000),
+    }
+
+    # enhance_prompt not supported on veo-3.x
+    if args.enhance_prompt:
+        if model.startswith("veo-2"):
+            config_kwargs["enhance_prompt"] = True
+        else:
+            print(f"Note: --enhance-prompt ignored, not supported by {model}")
+
+    if args.resolution:
+        config_kwargs["resolution"] = args.resolution
+    if args.negative_prompt:
+        config_kwargs["negative_prompt"] = args.negative_prompt
+    if args.person_generation:
+        config_kwargs["person_generation"] = args.person_generation
+    return config_kwargs
+
+
+def max_videos_per_request(model: str) -> int:
+    # Gemini API caps number_of_videos per request: 2 on veo-2.0, 1 on veo-3.x
+    return 2 if model.startswith("veo-2") else 1
+
+
+def split_count(count: int, per_request: int) -> list[int]:
+    full, rest = divmod(count, per_request)
+    return [per_request] * full + ([rest] if rest else [])
 
 
 def load_image(path: str):
-    from google.genai import types
     with open(path, "rb") as f:
         data = f.read()
-    ext = Path(path).suffix.lower()
-    mime_map = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp"}
-    return types.Image(image_bytes=data, mime_type=mime_map.get(ext, "image/png"))
+    mime_type = sniff_mime(data[:12])
+    if mime_type is None:
+        raise ValueError(f"{path} is not a JPEG, PNG or WebP image")
+    return _genai_types.Image(image_bytes=data, mime_type=mime_type)
+
+
+def load_images(paths: list[str]) -> list:
+    # Same file passed more than once (e.g. as input and element) is read once
+    resolved = [str(Path(p).resolve()) for p in paths]
+    unique = list(dict.fromkeys(resolved))
+    if len(unique) <= 1:
+        images = [load_image(p) for p in unique]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_LOAD_WORKERS, len(unique))) as ex:
+            images = list(ex.map(load_image, unique))
+    loaded = dict(zip(unique, images))
+    return [loaded[p] for p in resolved]
+
+
+@functools.cache
+def http_pool():
+    """Shared keep-alive connection pool for video downloads."""
+    import urllib3
+    # Never forward the API key header if the download redirects to another host
+    strip = urllib3.Retry.DEFAULT_REMOVE_HEADERS_ON_REDIRECT | {"x-goog-api-key"}
+    return urllib3.PoolManager(
+        maxsize=MAX_SAVE_WORKERS,
+        timeout=urllib3.Timeout(connect=DOWNLOAD_CONNECT_TIMEOUT, read=DOWNLOAD_READ_TIMEOUT),
+        retries=urllib3.Retry(total=3, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                              remove_headers_on_redirect=strip))
+
+
+def download_video(url: str, out: Path, api_key: str):
+    # The pool's Retry re-sends the request on connect errors and 5xx responses, but
+    # not once the body is streaming; this restarts transfers that stall (read timeout)
+    # or are cut off mid-stream.
+    from urllib3.exceptions import ProtocolError, ReadTimeoutError
+    for attempt in range(DOWNLOAD_ATTEMPTS):
+        try:
+            _download_once(url, out, api_key)
+            return
+        except (ReadTimeoutError, ProtocolError):
+            if attempt == DOWNLOAD_ATTEMPTS - 1:
+                out.unlink(missing_ok=True)  # don't leave a truncated mp4 behind
+                raise
+            time.sleep(DOWNLOAD_RETRY_DELAY * 2 ** attempt)
+
+
+def _download_once(url: str, out: Path, api_key: str):
+    # Key goes in a header, not the query string, so urllib3 retry logs and errors never show it
+    resp = http_pool().request("GET", url, headers={"x-goog-api-key": api_key},
+                               preload_content=False)
+    try:
+        if resp.status != 200:
+            raise RuntimeError(f"download failed: HTTP {resp.status}")
+        # Buffered so short writes are retried; 1 MiB chunks pass straight through
+        with open(out, "wb") as f:
+            shutil.copyfileobj(resp, f, length=DOWNLOAD_CHUNK_SIZE)
+    finally:
+        resp.release_conn()
+
+
+def output_paths(output_path: Path, n: int, count: int) -> list[Path]:
+    if count > 1 or n > 1:
+        suffix = output_path.suffix or ".mp4"
+        return [output_path.parent / f"{output_path.stem}-{i+1}{suffix}" for i in range(n)]
+    return [output_path if output_path.suffix else output_path.with_suffix(".mp4")]
+
+
+def write_all(path: Path, data: bytes):
+    """Write data with raw os.write calls, preallocating the file where supported."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(path, flags, 0o666)  # same as open(): umask applies
+    try:
+        if hasattr(os, "posix_fallocate") and data:
+            try:
+                os.posix_fallocate(fd, 0, len(data))
+            except OSError:
+                pass  # filesystem without fallocate support
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view[:WRITE_CHUNK_SIZE]):]
+    finally:
+        os.close(fd)
+
+
+def status(msg: str, file=None):
+    """Print a full line over the in-place progress indicator."""
+    file = file or sys.stdout
+    file.write(f"\r{msg:<{PROGRESS_WIDTH}}\n")  # one write, so save threads don't interleave
+    file.flush()
+
+
+def save_video(video, out: Path, api_key: str) -> str | None:
+    v = video.video
+    if v.video_bytes:
+        write_all(out, v.video_bytes)
+        v.video_bytes = None  # drop our reference so each video is freed once saved
+    elif v.uri:
+        download_video(v.uri, out, api_key)
+    else:
+        status(f"Error: no video data for {out}", file=sys.stderr)
+        return None
+
+    status(f"Saved: {out}")
+    return str(out)
+
+
+@functools.cache
+def transient_errors() -> tuple:
+    """Exceptions worth retrying a poll for: timeouts, dropped connections, 5xx."""
+    import httpx
+    from google.genai import errors
+    return (TimeoutError, ConnectionError, httpx.TransportError, errors.ServerError)
+
+
+async def wait_for_operation(client, operation):
+    # The Gemini API exposes no long-poll (operations:wait) for Veo jobs and
+    # operations.get takes no server-side wait hint, so we poll with backoff.
+    poll_config = _genai_types.GetOperationConfig(
+        http_options=_genai_types.HttpOptions(timeout=POLL_TIMEOUT * 1000))
+    delay = POLL_INITIAL_DELAY
+    failures = 0
+    while not operation.done:
+        await asyncio.sleep(delay + random.uniform(0, POLL_JITTER))
+        delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+        try:
+            operation = await client.aio.operations.get(operation, config=poll_config)
+        except transient_errors() as e:
+            failures += 1
+            if failures >= POLL_MAX_FAILURES:
+                # The job keeps running (and billing) server-side; give the user its name
+                raise RuntimeError(f"gave up polling after {failures} failed attempts; "
+                                   f"operation {operation.name} may still complete") from e
+            # Stalled or dropped poll; retry after the next backoff step
+            status(f"Note: poll failed ({type(e).__name__}), retrying "
+                   f"({failures}/{POLL_MAX_FAILURES - 1})", file=sys.stderr)
+            continue
+        failures = 0
+    return operation
+
+
+async def show_progress(start: float, pending: set):
+    """Rewrite a single 'Waiting… Ns' line while any batch is still generating."""
+    while pending:
+        sys.stdout.write(f"\rWaiting… {int(time.monotonic() - start)}s")
+        sys.stdout.flush()
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+
+async def run_operation(client, operation, offset: int, args, api_key: str,
+                        start: float, pending: set,
+                        save_pool: ThreadPoolExecutor | None) -> list[str]:
+    """Wait for one batch, then save its videos as output numbers offset+1, offset+2, ..."""
+    try:
+        operation = await wait_for_operation(client, operation)
+    finally:
+        pending.discard(offset)
+    elapsed = int(time.monotonic() - start)
+    if not operation.response or not operation.response.generated_videos:
+        status(f"Error: No videos generated (after {elapsed}s).", file=sys.stderr)
+        return []
+    status(f"Done in {elapsed}s.")
+
+    videos = operation.response.generated_videos
+    paths = output_paths(Path(args.filename), offset + len(videos), args.count)[offset:]
+    if save_pool is None:
+        # --count 1: nothing else is running, so save inline without a thread pool
+        results = []
+        for video, path in zip(videos, paths):
+            try:
+                results.append(save_video(video, path, api_key))
+            except Exception as e:
+                results.append(e)
+    else:
+        # save_pool is shared by all batches, so concurrent downloads never exceed the HTTP pool
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(
+            loop.run_in_executor(save_pool, save_video, video, path, api_key)
+            for video, path in zip(videos, paths)
+        ), return_exceptions=True)
 
+    saved = []
+    for path, result in zip(paths, results):
+        if isinstance(result, BaseException):
+            status(f"Error: saving {path} failed: {result}", file=sys.stderr)
+        elif result:
+            saved.append(result)
+    return saved
 
-def main():
+
+async def amain():
     parser = argparse.ArgumentParser(
         description="Generate video with Veo via Gemini API",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -75,6 +377,9 @@ Model aliases:
 
 Duration must be even: 4, 6, or 8 seconds. Odd values are rounded automatically.
 
+--enhance-prompt (veo-2.0 only) rewrites the prompt with an extra LLM pass before
+generation: better results from short prompts, but adds latency. Off by default.
+
 Examples:
   generate_video.py --prompt "sunset" --filename out.mp4
   generate_video.py --prompt "sunset" --model quality --filename out.mp4 --resolution 1080p
@@ -97,6 +402,8 @@ Examples:
     parser.add_argument("--negative-prompt", help="Things to avoid in the video")
     parser.add_argument("--count", type=int, default=1,
                         help="Number of videos to generate (default: 1)")
+    parser.add_argument("--enhance-prompt", action=argparse.BooleanOptionalAction, default=False,
+                        help="Let the API rewrite the prompt before generating (veo-2.0 only; default: off)")
     parser.add_argument("--person-generation", choices=["allow_adult", "allow_all", "dont_allow"],
                         help="Person generation policy")
 
@@ -115,22 +422,37 @@ Examples:
                         help="List available Veo models from the API and exit")
 
     args = parser.parse_args()
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+
+    # Validate every image before the SDK import or any upload, so typos fail fast
+    elements = args.element or []
+    styles = args.style or []
+    image_paths = ([args.input_image] if args.input_image else []) + elements + styles
+    errors = [err for err in map(check_image, image_paths) if err]
+    if errors:
+        parser.error("\n  ".join(errors))
 
     api_key = args.api_key or os.environ.get("GEMINI_API_KEY")
     if not api_key and not args.list_models:
         print("Error: No API key. Use --api-key or set GEMINI_API_KEY.", file=sys.stderr)
         sys.exit(1)
 
+    global _genai_types
     from google import genai
     from google.genai import types
+    _genai_types = types
 
+    # The client holds one keep-alive HTTP pool, reused by the submit and every poll.
+    # Downloads go through http_pool() instead so they can stream to disk.
     client = genai.Client(api_key=api_key)
 
     if args.list_models:
         print("Available Veo models:")
-        for m in client.models.list():
+        # Print matches as each page arrives rather than after the full listing
+        async for m in await client.aio.models.list():
             if "veo" in m.name.lower():
-                print(f"  {m.name}")
+                print(f"  {m.name}", flush=True)
         print("\nAliases:")
         for alias, model in MODEL_ALIASES.items():
             print(f"  {alias:10s} → {model}")
@@ -141,50 +463,32 @@ Examples:
     # Snap duration to valid value
     duration = nearest_valid_duration(args.duration)
     if duration != args.duration:
-        print(f"Note: duration {args.duration}s rounded to {duration}s (valid: 4, 6, 8)")
+        print(f"Note: duration {args.duration}s rounded to {duration}s "
+              f"(valid: even values {MIN_DURATION}-{MAX_DURATION})")
 
-    # Input image
-    input_image = None
+    # Load input and reference images concurrently
     if args.input_image:
         print(f"Loading input image: {args.input_image}")
-        input_image = load_image(args.input_image)
-
-    # Build config
-    config_kwargs = {
-        "number_of_videos": args.count,
-        "duration_seconds": duration,
-        "aspect_ratio": args.aspect_ratio,
-    }
-
-    # enhance_prompt not supported on veo-3.x
-    if model.startswith("veo-2"):
-        config_kwargs["enhance_prompt"] = True
+    for path in elements:
+        print(f"Loading element: {path}")
+    for path in styles:
+        print(f"Loading style: {path}")
+    images = load_images(image_paths)
+    input_image = images.pop(0) if args.input_image else None
 
-    if args.resolution:
-        config_kwargs["resolution"] = args.resolution
-    if args.negative_prompt:
-        config_kwargs["negative_prompt"] = args.negative_prompt
-    if args.person_generation:
-        config_kwargs["person_generation"] = args.person_generation
+    config_kwargs = build_config_kwargs(args, model, duration)
 
     # Reference images
-    reference_images = []
-    for path in (args.element or []):
-        print(f"Loading element: {path}")
-        reference_images.append(types.VideoGenerationReferenceImage(
-            image=load_image(path),
-            reference_type=types.VideoGenerationReferenceType.ASSET,
-        ))
-    for path in (args.style or []):
-        print(f"Loading style: {path}")
-        reference_images.append(types.VideoGenerationReferenceImage(
-            image=load_image(path),
-            reference_type=types.VideoGenerationReferenceType.STYLE,
-        ))
+    ref_types = ([types.VideoGenerationReferenceType.ASSET] * len(elements) +
+                 [types.VideoGenerationReferenceType.STYLE] * len(styles))
+    reference_images = [
+        types.VideoGenerationReferenceImage(image=image, reference_type=ref_type)
+        for image, ref_type in zip(images, ref_types)
+    ]
     if reference_images:
         config_kwargs["reference_images"] = reference_images
 
-    config = types.GenerateVideosConfig(**config_kwargs)
+    batches = split_count(args.count, max_videos_per_request(model))
 
     # Summary
     print(f"Generating video...")
@@ -195,49 +499,61 @@ Examples:
     if input_image:
         print(f"  Input:    {args.input_image}")
     if reference_images:
-        print(f"  Refs:     {len(args.element or [])} elements, {len(args.style or [])} styles")
+        print(f"  Refs:     {len(elements)} elements, {len(styles)} styles")
+    if len(batches) > 1:
+        print(f"  Count:    {args.count} videos in {len(batches)} parallel requests")
 
-    generate_kwargs = {"model": model, "prompt": args.prompt, "config": config}
+    generate_kwargs = {"model": model, "prompt": args.prompt}
     if input_image:
         generate_kwargs["image"] = input_image
 
-    operation = client.models.generate_videos(**generate_kwargs)
-
-    print("Waiting", end="", flush=True)
-    while not operation.done:
-        time.sleep(5)
-        operation = client.operations.get(operation)
-        print(".", end="", flush=True)
-    print(" done.")
-
-    if not operation.response or not operation.response.generated_videos:
-        print("Error: No videos generated.", file=sys.stderr)
+    # Submit every batch before polling so the generations overlap server-side.
+    # A failed submit (e.g. 429) must not abandon batches that were accepted and billed.
+    submitted = await asyncio.gather(*(
+        client.aio.models.generate_videos(
+            **generate_kwargs,
+            config=types.GenerateVideosConfig(**{**config_kwargs, "number_of_videos": n}),
+        )
+        for n in batches
+    ), return_exceptions=True)
+
+    offsets = [sum(batches[:i]) for i in range(len(batches))]
+    accepted = []
+    for i, result in enumerate(submitted):
+        if isinstance(result, BaseException):
+            print(f"Error: batch {i+1}/{len(batches)} was not submitted: {result}", file=sys.stderr)
+        else:
+            accepted.append((i, result))
+    if not accepted:
         sys.exit(1)
 
-    output_path = Path(args.filename)
+    start = time.monotonic()
+    pending = {offsets[i] for i, _ in accepted}
+    progress = asyncio.create_task(show_progress(start, pending))
+    save_ctx = (ThreadPoolExecutor(max_workers=min(args.count, MAX_SAVE_WORKERS))
+                if args.count > 1 else contextlib.nullcontext())
+    with save_ctx as save_pool:
+        results = await asyncio.gather(*(
+            run_operation(client, operation, offsets[i], args, api_key, start, pending, save_pool)
+            for i, operation in accepted
+        ), return_exceptions=True)
+    progress.cancel()
+
     saved = []
-    for i, video in enumerate(operation.response.generated_videos):
-        if args.count > 1:
-            out = output_path.parent / f"{output_path.stem}-{i+1}{output_path.suffix or '.mp4'}"
-        else:
-            out = output_path if output_path.suffix else output_path.with_suffix(".mp4")
-
-        v = video.video
-        if v.video_bytes:
-            with open(out, "wb") as f:
-                f.write(v.video_bytes)
-        elif v.uri:
-            url = f"{v.uri}&key={api_key}" if "?" in v.uri else f"{v.uri}?key={api_key}"
-            urllib.request.urlretrieve(url, out)
+    for (i, _), result in zip(accepted, results):
+        if isinstance(result, BaseException):
+            status(f"Error: batch {i+1}/{len(batches)} failed: {result}", file=sys.stderr)
         else:
-            print(f"Error: no video data for output {i+1}", file=sys.stderr)
-            continue
-
-        saved.append(str(out))
-        print(f"Saved: {out}")
+            saved.extend(result)
+    if not saved:
+        sys.exit(1)
 
     print(f"\nOutput: {saved[0]}" if len(saved) == 1 else f"\nOutputs: {', '.join(saved)}")
 
 
+def main():
+    asyncio.run(amain())
+
+
 if __name__ == "__main__":
     main()